@@ -5,7 +5,7 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 
 class PharmaAgent:
-    def __init__(self):
+    def __init__(self, driver_path=None):
         # Site Configuration
         self.sites = [
             {"name": "MockPharma A", "url": "http://localhost:3001", "id": "site_a"},
@@ -14,7 +14,9 @@ class PharmaAgent:
         
         options = webdriver.ChromeOptions()
         options.add_argument("--start-maximized")
-        self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        # driver_path lets a caller resolve chromedriver once for many agents
+        driver_path = driver_path or ChromeDriverManager().install()
+        self.driver = webdriver.Chrome(service=Service(driver_path), options=options)
 
     def get_product_details(self, site_url, medicine_name):
         """Scrapes BOTH Price and Delivery Days."""
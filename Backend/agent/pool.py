@@ -0,0 +1,68 @@
+import os
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+from webdriver_manager.chrome import ChromeDriverManager
+from agent.bot import PharmaAgent
+
+# Each worker is a visible Chrome window
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
+# One long-lived browser per worker process
+_bot = None
+_driver_path = None
+
+def _init_bot(driver_path=None):
+    """Runs once in each worker: start its browser so orders don't pay for it."""
+    global _bot, _driver_path
+    if driver_path:
+        _driver_path = driver_path
+    try:
+        _bot = PharmaAgent(driver_path=_driver_path)
+        # Quit Chrome when the pool shuts the worker down
+        multiprocessing.util.Finalize(_bot, _bot.close, exitpriority=10)
+    except Exception as e:
+        # Don't break the whole pool; run_order retries the launch
+        print(f"[POOL] Bot init failed: {e}")
+        _bot = None
+
+def _warm_up():
+    return os.getpid()
+
+def run_order(medicines, priority):
+    """Executes in a worker process with that worker's persistent bot."""
+    if _bot is None:
+        _init_bot()
+    if _bot is None:
+        return []
+    try:
+        return _bot.process_order(medicines, user_priority=priority)
+    except Exception as e:
+        print(f"Bot Error: {e}")
+        # The browser is probably gone; replace it for the next order
+        try:
+            _bot.close()
+        except Exception:
+            pass
+        _init_bot()
+        return []
+
+def create_bot_pool(max_workers=BOT_WORKERS):
+    """
+    Pool of worker processes, each holding a ready PharmaAgent.
+    'spawn' keeps workers from inheriting the API process's CUDA/OCR state.
+    Blocking (driver download, process start-up): call it from a thread.
+    """
+    # Resolve chromedriver once here rather than in every worker at once,
+    # which would race on webdriver_manager's shared cache
+    driver_path = ChromeDriverManager().install()
+    pool = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_bot,
+        initargs=(driver_path,),
+    )
+    # Submitting one task per worker starts them all now, not on the first order
+    for _ in range(max_workers):
+        pool.submit(_warm_up)
+    return pool
@@ -1,23 +1,101 @@
-from fastapi import FastAPI, UploadFile, File, Form
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel 
-import easyocr
-import shutil
 import google.generativeai as genai
 import os
-import json
-import requests
+from typing import Optional
+import httpx
+import hashlib
+from cachetools import LRUCache
+import threading
+import time
 import webbrowser
+from async_lru import alru_cache
 from datetime import date, timedelta
 from dotenv import load_dotenv
 
-from agent.bot import PharmaAgent 
+# Before the local imports: ocr_service / agent.pool read their settings at import
+load_dotenv()
+
+from agent.pool import create_bot_pool, run_order
 from calendar_service import add_checkup_event 
 from maps_service_osm import find_labs_osm 
+from ocr_service import get_reader, ocr_queue, decode_upload
 
-load_dotenv()
+# 2. SETUP GEMINI
+api_key = os.getenv("GEMINI_API_KEY")
+if not api_key:
+    print("Warning: API Key missing. Bot will use Mock Data.")
+    api_key = "dummy_key"
+
+genai.configure(api_key=api_key)
+
+# The SDK sends no 'required' list, so Gemini may omit any field: every
+# field except the medicine name needs a default or validation rejects it.
+class Medicine(BaseModel):
+    name: str
+    dosage: str = ""
+    frequency: str = ""
+    instructions: str = ""
+
+class PrescriptionSchema(BaseModel):
+    medicines: list[Medicine] = []
+    tests: list[str] = []
+    next_visit: Optional[str] = None  # YYYY-MM-DD
+
+# JSON mode + schema: the SDK guarantees parseable output, no fence stripping.
+# Low temperature keeps extraction deterministic (and responses cache-friendly).
+model = genai.GenerativeModel(
+    'gemini-2.5-flash',
+    generation_config=genai.GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=PrescriptionSchema,
+        temperature=0.1,
+    ),
+)
+
+def create_http_client():
+    """
+    One pooled client for every outbound call (ip-api, Nominatim) so TCP/TLS
+    handshakes are amortised across requests. Connection failures are retried.
+    """
+    return httpx.AsyncClient(
+        timeout=10,
+        headers={"User-Agent": "MedVision-Project/1.0"},
+        # With a custom transport the client's own limits/http2 are ignored
+        transport=httpx.AsyncHTTPTransport(
+            retries=2,
+            http2=True,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        ),
+    )
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.http = create_http_client()
+    app.state.bot_pool = None
+    try:
+        # Prime the server-location cache so no request pays for the probe
+        await get_auto_location(app.state.http)
+        await check_prefix_tokens()
+        try:
+            app.state.bot_pool = await asyncio.to_thread(create_bot_pool)
+        except Exception as e:
+            # The bot is optional: OCR and parsing still work without Chrome
+            print(f"⚠️ Shopping bot unavailable: {e}")
+        get_reader()  # load + warm the OCR models before the first upload
+        ocr_queue.start()
+        yield
+    finally:
+        # Also runs if start-up fails, so Chrome workers aren't leaked
+        await ocr_queue.stop()
+        await app.state.http.aclose()
+        if app.state.bot_pool:
+            await asyncio.to_thread(app.state.bot_pool.shutdown, wait=True, cancel_futures=True)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 1. ENABLE CORS
 app.add_middleware(
@@ -28,141 +106,272 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 2. SETUP GEMINI
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("Warning: API Key missing. Bot will use Mock Data.")
-    api_key = "dummy_key"
+# ip-api geolocates the *server's* IP, which doesn't change per request:
+# probe once a day. Failures raise, so they aren't cached by alru_cache;
+# get_auto_location backs off instead of re-probing on every request.
+PROBE_RETRY_AFTER = 5 * 60
+_probe_failed_at = None
 
-genai.configure(api_key=api_key)
+@alru_cache(maxsize=1, ttl=24 * 60 * 60)
+async def probe_server_location(client):
+    response = await client.get("http://ip-api.com/json", timeout=3)
+    data = response.json()
+    if data['status'] != 'success':
+        raise ValueError(f"ip-api lookup failed: {data.get('message')}")
+    return float(data['lat']), float(data['lon'])
+
+async def get_auto_location(client):
+    """Auto-detects (server) location via IP; cached for 24h, failures for 5 min."""
+    global _probe_failed_at
+    if _probe_failed_at and time.monotonic() - _probe_failed_at < PROBE_RETRY_AFTER:
+        return 0.0, 0.0
+    try:
+        return await probe_server_location(client)
+    except Exception:
+        _probe_failed_at = time.monotonic()
+        return 0.0, 0.0
+
+# Static instructions + few-shot examples go FIRST and never change, so
+# Gemini 2.5's implicit context cache can reuse them across requests.
+# Implicit caching only kicks in above 1024 prompt tokens on gemini-2.5-flash;
+# this block is only just over that, so check_prefix_tokens() re-counts it at
+# start-up. Keep anything per-request (date, OCR text) out of this block.
+SYSTEM_PREFIX = """
+You are a medical assistant that reads OCR text of doctor's prescriptions.
+The OCR text is noisy: words may be split, merged, misspelled or out of order,
+and handwriting often turns letters into digits (O -> 0, l -> 1, S -> 5).
+
+Tasks:
+1. Extract medicines with detailed intake instructions.
+   - "name": the medicine or brand name, corrected to its usual spelling.
+   - "dosage": strength per unit (e.g. 500mg, 10ml, 1 puff). Use "" if absent.
+   - "frequency": the schedule as written (e.g. 1-0-1, Twice daily, SOS, HS).
+   - "instructions": how to take it (e.g. After food, Empty stomach, Before sleep,
+     for 5 days). Expand abbreviations: AC = before food, PC = after food,
+     HS = at bedtime, SOS = only when needed, OD = once daily, BD = twice daily,
+     TDS = three times daily, QID = four times daily.
+2. Extract tests: every investigation the doctor ordered (blood tests, urine
+   tests, scans, X-rays, ECG ...), each as a short human readable name.
+3. Calculate 'next_visit' based on text like "Review in 3 days", "Follow up
+   after 1 week" or "Come back on 12/03" by adding to TODAY's date (given at the
+   end of the prompt). Use null when no follow-up is mentioned.
+
+Never invent medicines or tests that are not supported by the text.
+
+Output JSON of this shape:
+{
+  "medicines": [
+    {
+      "name": "str",
+      "dosage": "str",
+      "frequency": "str (e.g. 1-0-1 or Twice daily)",
+      "instructions": "str (e.g. After food, Empty stomach, Before sleep)"
+    }
+  ],
+  "tests": ["str"],
+  "next_visit": "YYYY-MM-DD" or null
+}
 
+--- EXAMPLE 1 ---
+Today: 2025-01-10
+Prescription: "Dr. A. Sharma MBBS MD Reg No 44821 City Clinic Pt Name Rahul Age 34 M
+c/o fever x 3 days body ache Rx 1) Tab Dolo 650 1-1-1 PC x 3 days 2) Tab Azithral
+500 1-0-0 x 3 days after lunch 3) Syp Ascoril LS 10ml TDS Adv CBC Widal test
+Review after 5 days plenty of fluids"
+Output:
+{
+  "medicines": [
+    {"name": "Dolo 650", "dosage": "650mg", "frequency": "1-1-1", "instructions": "After food, for 3 days"},
+    {"name": "Azithral", "dosage": "500mg", "frequency": "1-0-0", "instructions": "After lunch, for 3 days"},
+    {"name": "Ascoril LS Syrup", "dosage": "10ml", "frequency": "Three times daily", "instructions": "As directed"}
+  ],
+  "tests": ["CBC", "Widal Test"],
+  "next_visit": "2025-01-15"
+}
 
-model = genai.GenerativeModel('gemini-2.5-flash')
+--- EXAMPLE 2 ---
+Today: 2025-03-02
+Prescription: "SUNRISE HOSPITAL Dept of Orthopaedics Name Meena K 58 F Dx Knee pain
+OA knee (R) Rx Tab Zerodol SP 1-0-1 PC x 7d Cap Pan 40 1-0-0 AC empty stomach
+Tab Shelcal 500 0-1-0 after lunch x 1 month Volini gel local application HS
+Inv X-Ray R knee AP/Lat Serum Vit D3 Serum Calcium F/U after 2 weeks with reports"
+Output:
+{
+  "medicines": [
+    {"name": "Zerodol SP", "dosage": "", "frequency": "1-0-1", "instructions": "After food, for 7 days"},
+    {"name": "Pan 40", "dosage": "40mg", "frequency": "1-0-0", "instructions": "Before breakfast, empty stomach"},
+    {"name": "Shelcal 500", "dosage": "500mg", "frequency": "0-1-0", "instructions": "After lunch, for 1 month"},
+    {"name": "Volini Gel", "dosage": "", "frequency": "Once daily", "instructions": "Apply locally at bedtime"}
+  ],
+  "tests": ["X-Ray Right Knee AP/Lateral", "Serum Vitamin D3", "Serum Calcium"],
+  "next_visit": "2025-03-16"
+}
 
-print("Loading OCR Engine...")
-reader = easyocr.Reader(['en'])
+--- EXAMPLE 3 ---
+Today: 2025-06-20
+Prescription: "Dr R Iyer MD (Medicine) Diabetes & Thyroid Clinic Pt Suresh 49 M
+known case T2DM HTN BP 150/94 FBS 182 Rx 1. Tab Glycomet GP 1 1-0-1 just before
+meals 2. Tab Telma 40 1-0-0 morning 3. Tab Atorva 10 0-0-1 HS 4. Tab Ecosprin 75
+0-1-0 after lunch Tests HbA1c Lipid profile Urine routine Kidney function test
+ECG Diet control walk 30 min daily no follow up date mentioned continue meds"
+Output:
+{
+  "medicines": [
+    {"name": "Glycomet GP 1", "dosage": "", "frequency": "1-0-1", "instructions": "Just before meals"},
+    {"name": "Telma 40", "dosage": "40mg", "frequency": "1-0-0", "instructions": "In the morning"},
+    {"name": "Atorva 10", "dosage": "10mg", "frequency": "0-0-1", "instructions": "At bedtime"},
+    {"name": "Ecosprin 75", "dosage": "75mg", "frequency": "0-1-0", "instructions": "After lunch"}
+  ],
+  "tests": ["HbA1c", "Lipid Profile", "Urine Routine", "Kidney Function Test", "ECG"],
+  "next_visit": null
+}
 
-def get_auto_location():
-    """Auto-detects location via IP."""
+--- NOW THE REAL PRESCRIPTION ---
+"""
+
+CACHE_MIN_TOKENS = 1024
+
+async def check_prefix_tokens():
+    """Warns if edits pushed SYSTEM_PREFIX under the implicit-cache minimum."""
     try:
-        response = requests.get("http://ip-api.com/json", timeout=3)
-        data = response.json()
-        if data['status'] == 'success':
-            return float(data['lat']), float(data['lon'])
-    except:
-        pass
-    return 0.0, 0.0
-
-def parse_with_ai(ocr_text_list):
+        tokens = (await model.count_tokens_async(SYSTEM_PREFIX)).total_tokens
+    except Exception as e:
+        print(f"[AI] Could not count prompt tokens: {e}")
+        return
+    print(f"[AI] System prefix: {tokens} tokens")
+    if tokens < CACHE_MIN_TOKENS:
+        print(f"⚠️ System prefix is under {CACHE_MIN_TOKENS} tokens; Gemini won't cache it.")
+
+# Re-submits of the same prescription skip the pipeline.
+# BLAKE2 (16-byte digest) is plenty for dedup and faster than SHA-1/SHA-256.
+def content_key(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+ocr_cache = LRUCache(maxsize=1024)    # upload bytes -> OCR lines
+parse_cache = LRUCache(maxsize=1024)  # (OCR text, today) -> structured data
+
+async def parse_with_ai(ocr_text_list):
     raw_text = " ".join(ocr_text_list)
     today_str = date.today().isoformat()
-    
-    prompt = f"""
-    You are a medical assistant. Today is {today_str}.
-    
-    Analyze this prescription: "{raw_text}"
-    
-    Tasks:
-    1. Extract medicines with detailed intake instructions.
-    2. Extract tests.
-    3. Calculate 'next_visit' date based on text like "Review in 3 days" (add to {today_str}).
-    
-    Return strict JSON (no markdown):
-    {{
-      "medicines": [ 
-        {{ 
-          "name": "str", 
-          "dosage": "str", 
-          "frequency": "str (e.g. 1-0-1 or Twice daily)", 
-          "instructions": "str (e.g. After food, Empty stomach, Before sleep)" 
-        }} 
-      ],
-      "tests": ["str"],
-      "next_visit": "YYYY-MM-DD" or null
-    }}
-    """
+
+    # Keyed on the date too: next_visit is relative to today
+    cache_key = (content_key(raw_text.encode()), today_str)
+    if cache_key in parse_cache:
+        print("[AI] Parse cache hit, skipping Gemini")
+        return parse_cache[cache_key]
+
     try:
-        response = model.generate_content(prompt)
-        clean_json = response.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_json)
+        response = await model.generate_content_async(
+            [SYSTEM_PREFIX, f'Today: {today_str}\nPrescription: "{raw_text}"\nOutput:']
+        )
+        cached = getattr(response.usage_metadata, "cached_content_token_count", 0)
+        print(f"[AI] Prompt cache hit: {cached} tokens")
+        structured_data = PrescriptionSchema.model_validate_json(response.text).model_dump()
+        # Only real answers are cached, never failures
+        parse_cache[cache_key] = structured_data
+        return structured_data
         
     except Exception as e:
         print(f"\n⚠️ AI ERROR: {e}")
-        # Fallback now includes instructions for the demo
-        fallback_date = (date.today() + timedelta(days=7)).isoformat()
-        return {
-            "medicines": [
-                {"name": "Paracetamol", "dosage": "650mg", "frequency": "SOS", "instructions": "Only for high fever"},
-                {"name": "Azithromycin", "dosage": "500mg", "frequency": "1-0-0", "instructions": "After lunch, do not skip"}
-            ],
-            "tests": ["CBC", "Chest X-Ray"],
-            "next_visit": fallback_date
-        }
+        return None
+
+def demo_prescription():
+    """Shown when parsing fails so the demo still renders; never acted on."""
+    fallback_date = (date.today() + timedelta(days=7)).isoformat()
+    return {
+        "medicines": [
+            {"name": "Paracetamol", "dosage": "650mg", "frequency": "SOS", "instructions": "Only for high fever"},
+            {"name": "Azithromycin", "dosage": "500mg", "frequency": "1-0-0", "instructions": "After lunch, do not skip"}
+        ],
+        "tests": ["CBC", "Chest X-Ray"],
+        "next_visit": fallback_date
+    }
 
 @app.post("/process-prescription")
 async def process_prescription(
+    request: Request,
     file: UploadFile = File(...),
     priority: str = Form("price"),
-    find_labs: bool = Form(True) 
+    find_labs: bool = Form(True),
+    # The browser's own coordinates; the IP probe only knows where the server is
+    lat: float = Form(0.0),
+    lng: float = Form(0.0)
 ):
-    temp_filename = f"temp_{file.filename}"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    try:
-        print(f"Processing {file.filename}...")
-        ocr_result = reader.readtext(temp_filename, detail=0)
-        
-        # AI PARSING
-        structured_data = parse_with_ai(ocr_result)
-        
-        # CALENDAR LOGIC
-        calendar_status = None
-        if structured_data.get("next_visit"):
-            print(f"📅 Checkup Date Found: {structured_data['next_visit']}")
-            # Uses your fixed calendar_service.py
-            calendar_status = add_checkup_event(structured_data['next_visit'], "Doctor Follow-up")
-        else:
-            print("📅 No checkup date found.")
-
-        # BOT & MAP LOGIC
-        bot = None
-        agent_report = []
-        map_url = None
-        
-        # A. Maps
-        detected_tests = structured_data.get("tests", [])
-        if detected_tests and find_labs:
-            print(f"🔬 Tests found: {detected_tests}")
-            lat, lng = get_auto_location()
-            if lat != 0.0:
-                map_data = find_labs_osm(lat, lng, detected_tests)
-                map_url = map_data.get("map_directions_link") or map_data.get("map_search_link")
-                if map_url:
-                    webbrowser.open(map_url)
-
-        # B. Shop
-        if structured_data.get("medicines"):
-            try:
-                print("💊 Launching Shopping Bot...")
-                bot = PharmaAgent()
-                agent_report = bot.process_order(structured_data["medicines"], user_priority=priority)
-                bot.close()
-            except Exception as e:
-                print(f"Bot Error: {e}")
-                if bot: bot.close()
-
+    # Decode in memory: no temp file, and the upload never touches disk
+    print(f"Processing {file.filename}...")
+    body = await file.read()
+    upload_key = content_key(body)
+    ocr_result = ocr_cache.get(upload_key)
+    if ocr_result is None:
+        img = await asyncio.to_thread(decode_upload, body)
+        if img is None:
+            return {"status": "error", "message": "Could not read the uploaded image."}
+        ocr_result = await ocr_queue.readtext(img)
+        ocr_cache[upload_key] = ocr_result
+    else:
+        print("[OCR] Same file seen before, reusing OCR result")
+    
+    # AI PARSING
+    structured_data = await parse_with_ai(ocr_result)
+    if structured_data is None:
+        # Don't book a follow-up or order medicines the prescription never had
         return {
             "status": "success",
-            "data": structured_data,
-            "calendar_event": calendar_status,
-            "agent_report": agent_report,
-            "map_url": map_url
+            "data": demo_prescription(),
+            "calendar_event": None,
+            "agent_report": [],
+            "map_url": None
         }
-        
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+    
+    # CALENDAR LOGIC
+    calendar_status = None
+    if structured_data.get("next_visit"):
+        print(f"📅 Checkup Date Found: {structured_data['next_visit']}")
+        # Uses your fixed calendar_service.py
+        calendar_status = await asyncio.to_thread(
+            add_checkup_event, structured_data['next_visit'], "Doctor Follow-up"
+        )
+    else:
+        print("📅 No checkup date found.")
+
+    # BOT & MAP LOGIC
+    agent_report = []
+    map_url = None
+    
+    # A. Maps
+    detected_tests = structured_data.get("tests", [])
+    if detected_tests and find_labs:
+        print(f"🔬 Tests found: {detected_tests}")
+        if lat == 0.0:
+            lat, lng = await get_auto_location(request.app.state.http)
+        if lat != 0.0:
+            map_data = await find_labs_osm(request.app.state.http, lat, lng, detected_tests)
+            map_url = map_data.get("map_directions_link") or map_data.get("map_search_link")
+            # The frontend opens map_url; this is only a local-dev convenience
+            if map_url and os.getenv("DEV_OPEN_BROWSER") == "1":
+                threading.Thread(target=webbrowser.open, args=(map_url,), daemon=True).start()
+
+    # B. Shop
+    bot_pool = request.app.state.bot_pool
+    if structured_data.get("medicines") and bot_pool:
+        print("💊 Launching Shopping Bot...")
+        # Runs on a pre-warmed browser in the bot pool (separate process, no GIL)
+        try:
+            agent_report = await asyncio.get_running_loop().run_in_executor(
+                bot_pool, run_order, structured_data["medicines"], priority
+            )
+        except Exception as e:
+            # e.g. BrokenProcessPool: still return the parsed prescription
+            print(f"Bot Error: {e}")
+            agent_report = []
+
+    return {
+        "status": "success",
+        "data": structured_data,
+        "calendar_event": calendar_status,
+        "agent_report": agent_report,
+        "map_url": map_url
+    }
 
 class LabSearchRequest(BaseModel):
     lat: float = 0.0
@@ -170,11 +379,12 @@ class LabSearchRequest(BaseModel):
     test_names: list[str]
 
 @app.post("/find-labs")
-async def find_labs_endpoint(request: LabSearchRequest):
+async def find_labs_endpoint(request: LabSearchRequest, http_request: Request):
+    client = http_request.app.state.http
     lat, lng = request.lat, request.lng
-    if lat == 0.0: lat, lng = get_auto_location()
+    if lat == 0.0: lat, lng = await get_auto_location(client)
     
-    result = find_labs_osm(lat, lng, request.test_names)
+    result = await find_labs_osm(client, lat, lng, request.test_names)
     return {
         "status": "success", 
         "url": result.get("map_directions_link")
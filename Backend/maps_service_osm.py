@@ -1,70 +1,110 @@
-import requests
-from math import radians, cos, sin, asin, sqrt
+import re
+import numpy as np
+from async_lru import alru_cache
+from sklearn.neighbors import BallTree
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Haversine formula to calculate distance in km."""
-    try:
-        lon1, lat1, lon2, lat2 = map(radians, [float(lon1), float(lat1), float(lon2), float(lat2)])
-        dlon = lon2 - lon1 
-        dlat = lat2 - lat1 
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a)) 
-        r = 6371 
-        return round(c * r, 2)
-    except Exception:
-        return 0.0
+EARTH_RADIUS_KM = 6371
+GRID_PRECISION = 2  # cache cell size in decimal degrees (~1.1 km)
+CELL_TTL = 24 * 60 * 60  # labs don't move; refresh a cell once a day
+
+class LabIndex:
+    """
+    Caches Nominatim results per rounded (lat, lng) grid cell, each in a
+    haversine BallTree so nearest-lab lookups don't re-sort the whole list.
+    """
+
+    async def _fetch(self, client, lat, lng):
+        url = "https://nominatim.openstreetmap.org/search"
+        params = {
+            "q": "hospital clinic medical",
+            "lat": lat,
+            "lon": lng,
+            "format": "json",
+            "limit": 10,
+            "addressdetails": 1,
+            "dedupe": 1
+        }
+        response = await client.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    # Failed fetches raise, so only good cells are cached; concurrent misses
+    # on the same cell share one in-flight request.
+    @alru_cache(maxsize=4096, ttl=CELL_TTL)
+    async def _get_cell(self, client, cell_lat, cell_lng):
+        places = await self._fetch(client, cell_lat, cell_lng)
+        tree = None
+        if places:
+            coords = np.array([(float(p["lat"]), float(p["lon"])) for p in places])
+            tree = BallTree(np.radians(coords), metric="haversine")
+        return tree, places
+
+    async def nearest(self, client, lat, lng, k=5, max_km=15.0):
+        """[(place, distance_km), ...] nearest first, within max_km."""
+        tree, places = await self._get_cell(
+            client, round(float(lat), GRID_PRECISION), round(float(lng), GRID_PRECISION)
+        )
+        if tree is None:
+            return []
+        dists, idx = tree.query(np.radians([[float(lat), float(lng)]]), k=min(k, len(places)))
+        dists_km = dists[0] * EARTH_RADIUS_KM
+        return [
+            (places[i], round(float(d), 2))
+            for d, i in zip(dists_km, idx[0])
+            if d <= max_km
+        ]
+
+lab_index = LabIndex()
 
-def find_labs_osm(lat, lng, test_names=[]):
+# Test keywords -> Google Maps search term, checked in order (imaging
+# before pathology). Extend by adding words/rows, no new branches needed.
+ROUTE = [
+    (frozenset({"xray", "scan", "mri", "ct", "ultrasound", "usg"}), "Diagnostic Centre"),
+    (frozenset({"blood", "bloodwork", "cbc", "urine", "lipid"}), "Pathology Lab"),
+]
+DEFAULT_QUERY_TERM = "Hospital"
+XRAY_RE = re.compile(r"x[\s-]?ray")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def test_tokens(test_names):
+    """Lower-cased words of the test names, split on hyphens, plurals folded."""
+    text = XRAY_RE.sub("xray", " ".join(test_names).lower())
+    tokens = set(TOKEN_RE.findall(text))
+    return tokens | {t[:-1] for t in tokens if t.endswith("s") and len(t) > 3}
+
+def pick_query_term(test_names):
+    tokens = test_tokens(test_names)
+    return next((term for kws, term in ROUTE if kws & tokens), DEFAULT_QUERY_TERM)
+
+async def find_labs_osm(client, lat, lng, test_names=[]):
     """
+    client: shared httpx.AsyncClient (carries the User-Agent Nominatim requires)
     1. Fetches raw data from OSM (Nominatim).
     2. Converts EVERYTHING into Google Maps Links.
     """
     
     # --- PART 1: FETCH RAW DATA ---
-    url = "https://nominatim.openstreetmap.org/search"
-    osm_query = "hospital clinic medical"
-    headers = { "User-Agent": "MedVision-Project/1.0" }
-    
-    params = {
-        "q": osm_query,
-        "lat": lat,
-        "lon": lng,
-        "format": "json",
-        "limit": 10,
-        "addressdetails": 1,
-        "dedupe": 1
-    }
-
     labs_list = []
     try:
-        response = requests.get(url, params=params, headers=headers)
-        data = response.json()
-        
-        for place in data:
+        # Nearest 5 within 15km, already sorted (Index 0 is Nearest)
+        for place, dist in await lab_index.nearest(client, lat, lng, k=5, max_km=15.0):
             p_lat = place.get("lat")
             p_lon = place.get("lon")
             name = place.get("display_name", "").split(",")[0]
+
+            # GENERATE INDIVIDUAL GOOGLE MAPS LINK
+            # Format: search/?api=1&query={name}&query_place_id={lat},{lon}
+            encoded_name = name.replace(" ", "+")
+            gmaps_link = f"https://www.google.com/maps/search/?api=1&query={encoded_name}&query_place_id={p_lat},{p_lon}"
             
-            dist = calculate_distance(lat, lng, p_lat, p_lon)
-            
-            # Filter: Must be within 15km
-            if dist <= 15.0:
-                # GENERATE INDIVIDUAL GOOGLE MAPS LINK
-                # Format: search/?api=1&query={name}&query_place_id={lat},{lon}
-                encoded_name = name.replace(" ", "+")
-                gmaps_link = f"https://www.google.com/maps/search/?api=1&query={encoded_name}&query_place_id={p_lat},{p_lon}"
-                
-                labs_list.append({
-                    "name": name,
-                    "full_address": place.get("display_name"),
-                    "lat": p_lat,
-                    "lon": p_lon,
-                    "distance_km": dist,
-                    "google_maps_link": gmaps_link # <--- Now Google, not OSM
-                })
-        
-        # Sort by distance (Index 0 is Nearest)
-        labs_list.sort(key=lambda x: x["distance_km"])
+            labs_list.append({
+                "name": name,
+                "full_address": place.get("display_name"),
+                "lat": p_lat,
+                "lon": p_lon,
+                "distance_km": dist,
+                "google_maps_link": gmaps_link # <--- Now Google, not OSM
+            })
 
     except Exception as e:
         print(f"[OSM] Data Fetch Error: {e}")
@@ -73,13 +113,7 @@ def find_labs_osm(lat, lng, test_names=[]):
     # --- PART 2: GENERATE MAIN ACTION LINKS (Standard Google Format) ---
     
     # Logic: Pick the best search term
-    tests_str = " ".join(test_names).lower()
-    if "x-ray" in tests_str or "scan" in tests_str:
-        query_term = "Diagnostic Centre"
-    elif "blood" in tests_str:
-        query_term = "Pathology Lab"
-    else:
-        query_term = "Hospital"
+    query_term = pick_query_term(test_names)
     
     # 1. SEARCH LINK (The "Explore" view)
     # Format: https://www.google.com/maps/search/?api=1&query={term}+near+{lat},{lng}
@@ -102,4 +136,4 @@ def find_labs_osm(lat, lng, test_names=[]):
         "labs": labs_list[:5],        
         "map_search_link": search_link,
         "map_directions_link": directions_link
-    }
\ No newline at end of file
+    }
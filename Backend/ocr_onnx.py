@@ -0,0 +1,192 @@
+import os
+import glob
+import cv2
+import numpy as np
+import torch
+import onnxruntime as ort
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+ONNX_DIR = os.getenv("OCR_ONNX_DIR", "onnx_models")
+RECOGNIZER_PATH = os.path.join(ONNX_DIR, "english_g2_rec.onnx")
+RECOGNIZER_INT8_PATH = os.path.join(ONNX_DIR, "english_g2_rec_int8.onnx")
+
+# ~200 cropped text lines from real prescriptions, used to calibrate int8 ranges
+CALIB_DIR = os.getenv("OCR_CALIB_DIR", "calibration_crops")
+CALIB_LIMIT = 200
+CALIB_WIDTH = 256
+
+CUDA_OPTIONS = {"arena_extend_strategy": "kSameAsRequested"}
+
+# cuDNN EXHAUSTIVE benchmarks every conv algorithm once per input shape and
+# then reuses the winner. Only worth it for the fixed-shape detector: the
+# recognizer's width changes per crop, so it would re-benchmark constantly.
+DETECTOR_CUDA_OPTIONS = {**CUDA_OPTIONS, "cudnn_conv_algo_search": "EXHAUSTIVE"}
+
+def get_providers(cuda_options=CUDA_OPTIONS):
+    """CUDA first, CPU as the fallback."""
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        return [("CUDAExecutionProvider", cuda_options), "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+class _RecognizerExport(torch.nn.Module):
+    """english_g2 ignores the 'text' argument at inference; drop it for export."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image):
+        return self.model(image, None)
+
+class OrtModule(torch.nn.Module):
+    """
+    Drop-in replacement for an EasyOCR torch module backed by an ORT session.
+    Takes/returns torch tensors so EasyOCR's pre/post-processing is untouched.
+    """
+
+    def __init__(self, session, device, fixed_hw=None):
+        super().__init__()
+        self.session = session
+        self.device = device
+        self.fixed_hw = fixed_hw
+        self.input_name = session.get_inputs()[0].name
+
+    def forward(self, x, *args):
+        x = x.detach().float().cpu().numpy()
+        h, w = x.shape[2], x.shape[3]
+
+        # Fixed-shape graph: pad smaller inputs up, crop the (H/2, W/2) maps back
+        if self.fixed_hw:
+            fh, fw = self.fixed_hw
+            if h > fh or w > fw:
+                raise ValueError(f"Detector input {h}x{w} exceeds fixed ONNX shape {fh}x{fw}")
+            if (h, w) != (fh, fw):
+                padded = np.zeros((x.shape[0], x.shape[1], fh, fw), dtype=np.float32)
+                padded[:, :, :h, :w] = x
+                x = padded
+
+        outputs = self.session.run(None, {self.input_name: x})
+        tensors = [torch.from_numpy(o).to(self.device) for o in outputs]
+
+        if self.fixed_hw and (h, w) != self.fixed_hw:
+            # score map is NHWC, feature map is NCHW
+            tensors[0] = tensors[0][:, : h // 2, : w // 2, :]
+            tensors[1] = tensors[1][:, :, : h // 2, : w // 2]
+
+        return tensors[0] if len(tensors) == 1 else tuple(tensors)
+
+def detector_path(det_hw):
+    """The detector graph is fixed-shape, so its cache file is keyed by H/W."""
+    return os.path.join(ONNX_DIR, f"craft_det_{det_hw[0]}x{det_hw[1]}.onnx")
+
+def export_detector(detector, det_hw, path):
+    """CRAFT -> ONNX with dynamic batch and a fixed H/W."""
+    net = getattr(detector, "module", detector).float().eval()
+    dummy = torch.zeros(1, 3, det_hw[0], det_hw[1], device=next(net.parameters()).device)
+    torch.onnx.export(
+        net, dummy, path,
+        input_names=["image"],
+        output_names=["score", "feature"],
+        dynamic_axes={"image": {0: "batch"}, "score": {0: "batch"}, "feature": {0: "batch"}},
+        opset_version=17,
+    )
+
+def export_recognizer(recognizer, path=RECOGNIZER_PATH):
+    """english_g2 recognizer -> ONNX; 64px high crops, dynamic batch and width."""
+    net = _RecognizerExport(getattr(recognizer, "module", recognizer).float().eval())
+    dummy = torch.zeros(1, 1, 64, 256, device=next(net.parameters()).device)
+    torch.onnx.export(
+        net, dummy, path,
+        input_names=["image"],
+        output_names=["preds"],
+        dynamic_axes={"image": {0: "batch", 3: "width"}, "preds": {0: "batch", 1: "steps"}},
+        opset_version=17,
+    )
+
+class CropCalibrationReader(CalibrationDataReader):
+    """Feeds prescription text crops, preprocessed like EasyOCR does, to the calibrator."""
+
+    def __init__(self, crop_dir=CALIB_DIR, limit=CALIB_LIMIT):
+        paths = sorted(
+            p for ext in ("*.png", "*.jpg", "*.jpeg")
+            for p in glob.glob(os.path.join(crop_dir, ext))
+        )[:limit]
+        if not paths:
+            raise FileNotFoundError(f"No calibration crops found in {crop_dir}")
+        self.paths = iter(paths)
+
+    def get_next(self):
+        for path in self.paths:
+            img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                continue
+            # 64px high, normalised to [-1, 1] (same as EasyOCR's AlignCollate)
+            img = cv2.resize(img, (CALIB_WIDTH, 64)).astype(np.float32) / 255.0
+            img = (img - 0.5) / 0.5
+            return {"image": img[np.newaxis, np.newaxis, :, :]}
+        return None
+
+def quantize_recognizer(fp32_path=RECOGNIZER_PATH, int8_path=RECOGNIZER_INT8_PATH):
+    """
+    Post-training int8 quantization of the recognizer:
+    static (calibrated) QDQ for the ResNet convs / linear layers, plus dynamic
+    weight-only quantization of the BiLSTM. CPU provider only (VNNI kernels).
+    """
+    prepped = int8_path.replace(".onnx", "_prep.onnx")
+    quant_pre_process(fp32_path, prepped)
+
+    quantize_static(
+        prepped, int8_path, CropCalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        op_types_to_quantize=["Conv", "MatMul", "Gemm"],
+    )
+
+    quantize_dynamic(int8_path, int8_path, op_types_to_quantize=["LSTM"], weight_type=QuantType.QInt8)
+
+    os.remove(prepped)
+
+def create_session(path, cuda_options=CUDA_OPTIONS):
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=opts, providers=get_providers(cuda_options))
+
+def accelerate_reader(reader, det_hw, int8=False):
+    """
+    Swaps reader.detector / reader.recognizer for ONNX Runtime sessions.
+    Models are exported once and reused from ONNX_DIR on later start-ups.
+    With int8=True the recognizer is served from a calibrated int8 graph on
+    CPU hosts; the detector is left unquantized.
+    """
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    det_path = detector_path(det_hw)
+    with torch.no_grad():
+        if not os.path.exists(det_path):
+            print(f"[ONNX] Exporting detector at {det_hw[0]}x{det_hw[1]}...")
+            export_detector(reader.detector, det_hw, det_path)
+        if not os.path.exists(RECOGNIZER_PATH):
+            print("[ONNX] Exporting recognizer...")
+            export_recognizer(reader.recognizer)
+
+    # The CUDA provider has no int8 kernels for QDQ graphs: it dequantizes
+    # back to FP32, which is slower than the FP32 graph (that needs TensorRT).
+    if int8 and "CUDAExecutionProvider" in ort.get_available_providers():
+        print("Warning: OCR_INT8 only speeds up the CPU provider, staying on FP32.")
+        int8 = False
+
+    rec_path = RECOGNIZER_PATH
+    if int8:
+        if not os.path.exists(RECOGNIZER_INT8_PATH):
+            print("[ONNX] Quantizing recognizer to int8...")
+            quantize_recognizer()
+        rec_path = RECOGNIZER_INT8_PATH
+
+    device = reader.device
+    reader.detector = OrtModule(create_session(det_path, DETECTOR_CUDA_OPTIONS), device, fixed_hw=tuple(det_hw))
+    reader.recognizer = OrtModule(create_session(rec_path), device)
+    print(f"[ONNX] OCR sessions on {reader.detector.session.get_providers()[0]}")
@@ -0,0 +1,48 @@
+import os
+import cv2
+from paddleocr import PaddleOCR
+
+# Smallest models shipped with paddleocr 3.1. Names / local dirs can be
+# overridden (e.g. for air-gapped deployments or newer model releases).
+DET_MODEL = os.getenv("OCR_PADDLE_DET", "PP-OCRv5_mobile_det")
+REC_MODEL = os.getenv("OCR_PADDLE_REC", "PP-OCRv5_mobile_rec")
+DET_MODEL_DIR = os.getenv("OCR_PADDLE_DET_DIR")
+REC_MODEL_DIR = os.getenv("OCR_PADDLE_REC_DIR")
+
+class PaddleReader:
+    """
+    Exposes the slice of easyocr.Reader that main.py uses (readtext /
+    readtext_batched with detail=0) on top of PaddleOCR. With enable_hpi
+    PaddleOCR picks the fastest installed backend, i.e. OpenVINO on Intel CPUs.
+    enable_hpi needs the high-performance-inference plugin, installed with
+    `paddleocr install_hpi_deps cpu` (see requirements-paddle.txt).
+    """
+
+    def __init__(self):
+        self.ocr = PaddleOCR(
+            text_detection_model_name=DET_MODEL,
+            text_recognition_model_name=REC_MODEL,
+            text_detection_model_dir=DET_MODEL_DIR,
+            text_recognition_model_dir=REC_MODEL_DIR,
+            # Prescriptions are uploaded upright; skip the extra classifier passes
+            use_doc_orientation_classify=False,
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+            enable_hpi=True,
+            device="cpu",
+        )
+
+    def readtext(self, image, detail=0, **kwargs):
+        """Returns the recognised lines as a flat list of strings."""
+        return self.readtext_batched([image], detail=detail)[0]
+
+    def readtext_batched(self, images, detail=0, **kwargs):
+        """One list of lines per input image; EasyOCR-only kwargs are ignored."""
+        if detail != 0:
+            raise ValueError("PaddleReader only supports detail=0")
+        # PaddleOCR wants 3-channel input; preprocessed pages are grayscale
+        images = [
+            cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if getattr(img, "ndim", 3) == 2 else img
+            for img in images
+        ]
+        return [list(res["rec_texts"]) for res in self.ocr.predict(images)]
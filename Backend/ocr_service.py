@@ -0,0 +1,205 @@
+import asyncio
+import os
+from functools import lru_cache
+import cv2
+import easyocr
+import numpy as np
+import torch
+
+# GPU OCR is 10-30x faster than CPU; fall back cleanly on CPU-only hosts.
+OCR_GPU = torch.cuda.is_available()
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "16" if OCR_GPU else "1"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+OCR_DECODER = os.getenv("OCR_DECODER", "greedy")
+OCR_ONNX = os.getenv("OCR_ONNX") == "1"
+OCR_INT8 = os.getenv("OCR_INT8") == "1"  # int8 recognizer, requires OCR_ONNX=1
+OCR_FP16 = os.getenv("OCR_FP16") == "1"  # half-precision torch models, GPU only
+
+# Uploads are shrunk so their longest side is at most OCR_MAX_SIDE (runtime
+# grows superlinearly with resolution). Each batch is padded only up to its
+# largest page so concurrent requests stack into one readtext_batched() pass;
+# OCR_IMAGE_SIZE is the upper bound (and the fixed ONNX detector shape).
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1600"))
+OCR_IMAGE_SIZE = (OCR_MAX_SIDE, OCR_MAX_SIDE)
+# Uploads per batched call. CRAFT runs the whole batch in one forward pass,
+# so on CPU (or a small GPU) a large batch of full-size pages can exhaust RAM.
+OCR_MAX_BATCH = int(os.getenv("OCR_MAX_BATCH", "16" if OCR_GPU else "1"))
+OCR_BATCH_WINDOW = 0.05  # seconds to wait for more uploads to join a batch
+
+def _inputs_to_half(module, args):
+    return tuple(a.half() if torch.is_tensor(a) and a.is_floating_point() else a for a in args)
+
+def _outputs_to_float(module, args, output):
+    if isinstance(output, tuple):
+        return tuple(o.float() if torch.is_tensor(o) else o for o in output)
+    return output.float()
+
+def enable_fp16(reader):
+    """
+    Runs the detector and recognizer in FP16 (tensor cores, half the bandwidth).
+    BatchNorm layers stay FP32 for stability; inputs are cast to half on the way
+    in and outputs back to float so EasyOCR's post-processing is unchanged.
+    """
+    for net in (reader.detector, reader.recognizer):
+        net.half()
+        for m in net.modules():
+            if isinstance(m, torch.nn.modules.batchnorm._BatchNorm):
+                m.float()
+        net.register_forward_pre_hook(_inputs_to_half)
+        net.register_forward_hook(_outputs_to_float)
+
+# 'easyocr' (default) or 'ppocrv6_tiny' (PaddleOCR + OpenVINO, for CPU-only hosts)
+OCR_BACKEND = os.getenv("OCR_BACKEND", "easyocr")
+
+@lru_cache(maxsize=None)
+def get_reader():
+    """
+    The process-wide OCR reader. Built (and warmed up) on first use only, so
+    importing this module never loads the models a second time.
+    """
+    print("Loading OCR Engine...")
+    if OCR_BACKEND == "ppocrv6_tiny":
+        from ocr_paddle import PaddleReader
+        reader = PaddleReader()
+    else:
+        # torch's dynamic int8 quantization (CPU default) can't be exported to ONNX
+        reader = easyocr.Reader(['en'], gpu=OCR_GPU, recog_network='english_g2', quantize=not OCR_ONNX)
+
+        if OCR_ONNX:
+            from ocr_onnx import accelerate_reader
+            # EasyOCR pads the detector input up to a multiple of 32
+            det_hw = tuple(-(-side // 32) * 32 for side in (OCR_IMAGE_SIZE[1], OCR_IMAGE_SIZE[0]))
+            accelerate_reader(reader, det_hw=det_hw, int8=OCR_INT8)
+        elif OCR_FP16:
+            if OCR_GPU:
+                enable_fp16(reader)
+            else:
+                print("Warning: OCR_FP16 needs a CUDA GPU, staying on FP32.")
+
+    # Warm-up: the first readtext() pays for CUDA kernel selection / lazy init.
+    # Do it once here so the first real prescription doesn't.
+    reader.readtext(np.zeros((64, 64, 3), dtype=np.uint8), detail=0)
+    print(f"OCR Engine ready ({OCR_BACKEND}, {'GPU' if OCR_GPU else 'CPU'}{', ONNX Runtime' if OCR_ONNX else ''}).")
+    return reader
+
+class BatchQueue:
+    """Coalesces concurrent OCR requests into batched reader calls."""
+
+    def __init__(self, max_batch=OCR_MAX_BATCH, window=OCR_BATCH_WINDOW):
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = asyncio.Queue()
+        self.worker = None
+
+    def start(self):
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+
+    async def readtext(self, img):
+        """Queues one image and waits for its list of text lines."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((img, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first item, then collect more until the batch
+            # is full or the coalescing window closes.
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images, (width, height) = pad_batch([img for img, _ in batch])
+            try:
+                results = await asyncio.to_thread(
+                    get_reader().readtext_batched,
+                    images,
+                    n_width=width,
+                    n_height=height,
+                    detail=0,
+                    batch_size=OCR_BATCH_SIZE,
+                    workers=OCR_WORKERS,
+                    decoder=OCR_DECODER,
+                )
+                for (_, future), text in zip(batch, results):
+                    if not future.done():
+                        future.set_result(text)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+ocr_queue = BatchQueue()
+
+def pad_batch(images):
+    """
+    Pads pages (white, bottom/right) to the largest page in the batch, so a
+    lone small upload isn't run through the detector at the full OCR_IMAGE_SIZE.
+    Returns the padded pages and their shared (width, height).
+    """
+    height = max(img.shape[0] for img in images)
+    width = max(img.shape[1] for img in images)
+    padded = []
+    for img in images:
+        h, w = img.shape[:2]
+        if (h, w) != (height, width):
+            img = cv2.copyMakeBorder(img, 0, height - h, 0, width - w, cv2.BORDER_CONSTANT, value=255)
+        padded.append(img)
+    return padded, (width, height)
+
+def deskew(binary):
+    """Straightens a binarised page using the min-area box around the ink."""
+    ink = np.column_stack(np.where(binary == 0))[:, ::-1].astype(np.float32)
+    if len(ink) < 50:
+        return binary
+    angle = cv2.minAreaRect(ink)[-1]
+    if angle > 45:  # OpenCV >= 4.5 reports (0, 90]
+        angle -= 90
+    if abs(angle) < 0.5:
+        return binary
+    h, w = binary.shape
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(binary, rotation, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+
+def preprocess(img):
+    """
+    Phone photo -> small, clean, upright page for OCR:
+    grayscale, downscale (longest side <= OCR_MAX_SIDE), adaptive threshold,
+    deskew. Aspect is preserved; BatchQueue pads pages to a common size.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    # Shrink first so thresholding/deskew run on the small image too
+    h, w = gray.shape
+    scale = OCR_MAX_SIDE / max(h, w)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+    binary = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+    )
+    return deskew(binary)
+
+def decode_upload(data):
+    """Upload bytes -> preprocessed page (None if not an image)."""
+    if not data:  # cv2.imdecode raises on an empty buffer
+        return None
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return preprocess(img)
@@ -10,6 +10,22 @@ fileInput.addEventListener('change', () => {
     document.getElementById('fileName').textContent = name ? `Selected: ${name}` : '';
 });
 
+// Ask the browser where the user is (the backend can only geolocate itself).
+// Resolves to null if denied/unavailable/slow so the upload is never blocked.
+function getBrowserLocation(timeoutMs = 3000) {
+    return new Promise((resolve) => {
+        if (!navigator.geolocation) return resolve(null);
+        // The Geolocation 'timeout' doesn't run while the permission prompt
+        // is open, so cap the total wait ourselves
+        const timer = setTimeout(() => resolve(null), timeoutMs);
+        navigator.geolocation.getCurrentPosition(
+            (pos) => { clearTimeout(timer); resolve(pos.coords); },
+            () => { clearTimeout(timer); resolve(null); },
+            { timeout: timeoutMs, maximumAge: 10 * 60 * 1000 }
+        );
+    });
+}
+
 form.addEventListener('submit', async (e) => {
     e.preventDefault();
     
@@ -25,6 +41,12 @@ form.addEventListener('submit', async (e) => {
     formData.append('file', fileInput.files[0]);
     formData.append('priority', document.getElementById('priority').value);
 
+    const coords = await getBrowserLocation();
+    if (coords) {
+        formData.append('lat', coords.latitude);
+        formData.append('lng', coords.longitude);
+    }
+
     try {
         // 3. Send to Backend
         // NOTE: The request will 'hang' here if the backend is waiting for 
@@ -63,6 +85,20 @@ function displayResults(data) {
         calCard.classList.add('hidden');
     }
 
+    // ------------------------------------------------------
+    // A2. MAP LINK (the server no longer opens a browser itself)
+    // ------------------------------------------------------
+    const mapCard = document.getElementById('mapCard');
+
+    if (data.map_url) {
+        mapCard.classList.remove('hidden');
+        document.getElementById('mapLink').href = data.map_url;
+        // May be blocked as a popup; the card link is the fallback
+        window.open(data.map_url, '_blank');
+    } else {
+        mapCard.classList.add('hidden');
+    }
+
     // ------------------------------------------------------
     // B. MEDICINE GUIDE (NEW FEATURE - PURPLE CARD)
     // ------------------------------------------------------